@@ -1,50 +1,303 @@
 # app.py
 import streamlit as st
 from streamlit_webrtc import webrtc_streamer, VideoTransformerBase, AudioProcessorBase
-import av, queue, os, tempfile
+import av, queue, os, threading
+from collections import OrderedDict
+from typing import List
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cv2
+from scipy.signal import resample_poly
 import google.generativeai as genai
-from gtts import gTTS
-import torch
-import base64
+from streamlit_autorefresh import st_autorefresh
 from PIL import Image
+import imagehash
+import simplejpeg
+from tts_cache import get_index as get_tts_index, tts_cached
 
 # -----------------------------
 # GEMINI CONFIG
 # -----------------------------
+@st.cache_resource
+def _configure_genai(api_key):
+    genai.configure(api_key=api_key)
+
 def configure_gemini():
     api_key = st.secrets.get("GOOGLE_API_KEY") or os.environ.get("GOOGLE_API_KEY")
     if not api_key:
         st.error("⚠️ Set GOOGLE_API_KEY in secrets or env vars")
         st.stop()
-    genai.configure(api_key=api_key)
+    _configure_genai(api_key)
 
 configure_gemini()
 
+@st.cache_resource
+def get_executor():
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="gemini")
+
+def warm_up(gmodel):
+    gmodel.generate_content("ping", generation_config={"max_output_tokens": 1})
+
+@st.cache_resource
+def get_gmodel():
+    gmodel = genai.GenerativeModel("gemini-1.5-flash")
+    # Open the connection in the background so the first capture reuses it.
+    get_executor().submit(warm_up, gmodel)
+    return gmodel
+
+get_gmodel()
+
+PROMPT = "Analyze this yoga pose and provide corrective feedback."
+
+# -----------------------------
+# GEMINI RESPONSE CACHE (perceptual hash)
+# -----------------------------
+class ResponseCache:
+    """LRU of Gemini feedback keyed by (phash, prompt); near-duplicate frames hit."""
+
+    def __init__(self, max_entries=64, max_distance=4):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def lookup(self, phash, prompt):
+        with self.lock:
+            for key, feedback in self.entries.items():
+                cached_hash, cached_prompt = key
+                if cached_prompt == prompt and phash - cached_hash <= self.max_distance:
+                    self.entries.move_to_end(key)
+                    return feedback
+        return None
+
+    def store(self, phash, prompt, feedback):
+        with self.lock:
+            self.entries[(phash, prompt)] = feedback
+            self.entries.move_to_end((phash, prompt))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+@st.cache_resource
+def gemini_cache():
+    return ResponseCache()
+
+def fit_within(frame, max_side):
+    """Downscale an RGB array so its long side is at most ``max_side``."""
+    h, w = frame.shape[:2]
+    ratio = max_side / max(h, w)
+    if ratio >= 1:
+        return frame
+    return cv2.resize(frame, (round(w * ratio), round(h * ratio)), interpolation=cv2.INTER_AREA)
+
+def encode_frame(frame):
+    """Downscale a captured frame and encode it as JPEG; returns (image, bytes)."""
+    arr = fit_within(frame, 768)
+    jpeg = simplejpeg.encode_jpeg(
+        arr, quality=82, colorspace="RGB", colorsubsampling="420", fastdct=True
+    )
+    return Image.fromarray(arr), jpeg
+
+def preview_jpeg(frame):
+    """Small JPEG for the on-page preview; cheaper to ship than the raw frame."""
+    thumb = fit_within(frame, 512)
+    return simplejpeg.encode_jpeg(
+        thumb, quality=80, colorspace="RGB", colorsubsampling="420", fastdct=True
+    )
+
+def analyze_frame(gmodel, cache, frame, parts):
+    """Preprocess ``frame`` and stream Gemini feedback into ``parts`` (worker thread)."""
+    img, img_bytes = encode_frame(frame)
+    phash = imagehash.phash(img, hash_size=16)
+    cached = cache.lookup(phash, PROMPT)
+    if cached is not None:
+        parts.append(cached)
+        return cached
+
+    image = genai.protos.Blob(mime_type="image/jpeg", data=img_bytes)
+    resp = gmodel.generate_content([PROMPT, image], stream=True)
+    for chunk in resp:
+        parts.append(chunk.text)
+    feedback = "".join(parts)
+    cache.store(phash, PROMPT, feedback)
+    return feedback
+
+def collect_analysis(pool, tts_index):
+    """Move a finished analysis into session state and start its speech."""
+    future, parts = st.session_state["analysis"]
+    if not future.done():
+        return
+    del st.session_state["analysis"]
+    try:
+        feedback = future.result()
+    except Exception as e:
+        st.session_state["analysis_error"] = str(e)
+        return
+    # The text is stored first, so a gTTS failure keeps the feedback.
+    st.session_state["feedback"] = feedback
+    st.session_state.pop("speech", None)
+    st.session_state["speech_job"] = pool.submit(tts_cached, feedback, "en", tts_index)
+
+def collect_speech():
+    """Move finished speech bytes into session state; pending synthesis is left alone."""
+    future = st.session_state["speech_job"]
+    if not future.done():
+        return
+    del st.session_state["speech_job"]
+    try:
+        st.session_state["speech"] = future.result()
+    except Exception as e:
+        st.session_state["analysis_error"] = f"Speech synthesis failed: {e}"
+
+def render_feedback():
+    st.markdown(f"**Feedback:** {st.session_state['feedback']}")
+    if "speech" in st.session_state:
+        st.audio(st.session_state["speech"], format="audio/mp3", autoplay=True)
+
 # -----------------------------
-# SPEECH RECOGNITION (Whisper tiny)
+# SPEECH RECOGNITION (faster-whisper tiny, int8)
 # -----------------------------
-import whisper
-model = whisper.load_model("tiny")
+@st.cache_resource
+def get_whisper():
+    from faster_whisper import WhisperModel
+    return WhisperModel(
+        "tiny.en",
+        device="cpu",
+        compute_type="int8",
+        cpu_threads=max(1, (os.cpu_count() or 2) // 2),
+    )
+
+@st.cache_resource
+def get_hotword_executor():
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="whisper")
+
+def find_hotword(whisper, audio):
+    """End time in seconds of the first 'click' in ``audio``, or None (worker thread)."""
+    segments, _ = whisper.transcribe(
+        audio,
+        language="en",
+        beam_size=1,
+        word_timestamps=True,
+        vad_filter=True,
+        vad_parameters={"min_silence_duration_ms": 300},
+    )
+    hit = next((w for seg in segments for w in seg.words if "click" in w.word.lower()), None)
+    return None if hit is None else hit.end
+
+SAMPLE_RATE = 16000       # what Whisper expects
+TRANSCRIBE_EVERY = 0.5    # seconds of new audio between Whisper runs
+WINDOW_SECONDS = 2        # sliding window kept for the hotword
+
+def to_pcm16(frame: av.AudioFrame) -> np.ndarray:
+    """Downmix a frame to mono int16 at its native sample rate."""
+    pcm = frame.to_ndarray()
+    scale = 32768.0 if np.issubdtype(pcm.dtype, np.integer) else 1.0
+    if frame.format.is_planar:
+        pcm = pcm.mean(axis=0)
+    else:
+        pcm = pcm.reshape(-1, len(frame.layout.channels)).mean(axis=1)
+    pcm = pcm / scale
+    return np.clip(pcm * 32767, -32768, 32767).astype(np.int16)
 
 class AudioProcessor(AudioProcessorBase):
+    # Samples are kept at the browser's rate and resampled once per window:
+    # resampling each 20 ms frame separately zero-pads its edges and puts a
+    # click at every frame boundary.
     def __init__(self):
-        self.q = queue.Queue()
-    def recv_audio(self, frame: av.AudioFrame) -> av.AudioFrame:
-        pcm = frame.to_ndarray()
-        self.q.put(pcm)
-        return frame
+        self.lock = threading.Lock()
+        self.rate = SAMPLE_RATE
+        self.active = np.zeros(0, dtype=np.int16)
+        self.offset = 0   # absolute sample index of active[0]
+        self.pending = 0  # samples received since the last window()
+    async def recv_queued(self, frames: List[av.AudioFrame]) -> List[av.AudioFrame]:
+        # recv() would only see frames[-1]; take every queued frame so the
+        # buffer has no gaps.
+        pcm = np.concatenate([to_pcm16(frame) for frame in frames])
+        with self.lock:
+            self.rate = frames[-1].sample_rate
+            self.active = np.concatenate([self.active, pcm])
+            overflow = len(self.active) - WINDOW_SECONDS * self.rate
+            if overflow > 0:
+                self.active = self.active[overflow:]
+                self.offset += overflow
+            self.pending += len(pcm)
+        return frames
+    def window(self):
+        """Return (offset, 16 kHz float32 audio) once TRANSCRIBE_EVERY seconds arrived."""
+        with self.lock:
+            if self.pending < TRANSCRIBE_EVERY * self.rate:
+                return None
+            self.pending = 0
+            offset, rate, pcm = self.offset, self.rate, self.active.copy()
+        audio = pcm.astype(np.float32) / 32768.0
+        if rate != SAMPLE_RATE:
+            audio = resample_poly(audio, SAMPLE_RATE, rate).astype(np.float32)
+        return offset, audio
+    def commit(self, offset, seconds):
+        """Drop audio up to ``seconds`` past window ``offset`` so a hotword fires once."""
+        with self.lock:
+            end = offset + int(seconds * self.rate)
+            drop = min(max(end - self.offset, 0), len(self.active))
+            self.active = self.active[drop:]
+            self.offset += drop
 
-audio_processor = AudioProcessor()
+# Reruns re-execute this script; keep the processor bound to the live stream.
+if "audio_processor" not in st.session_state:
+    st.session_state["audio_processor"] = AudioProcessor()
+audio_processor = st.session_state["audio_processor"]
 
 # -----------------------------
 # VIDEO CAPTURE
 # -----------------------------
-frame_queue = queue.Queue()
+if "frame_queue" not in st.session_state:
+    st.session_state["frame_queue"] = queue.Queue(maxsize=2)
+frame_queue = st.session_state["frame_queue"]
+
+def put_latest(q, item):
+    """Enqueue ``item``, discarding the oldest entries instead of blocking.
+
+    Returns how many stale entries were evicted.
+    """
+    evicted = 0
+    while True:
+        try:
+            q.put_nowait(item)
+            return evicted
+        except queue.Full:
+            try:
+                q.get_nowait()
+                evicted += 1
+            except queue.Empty:
+                pass
+
+def drain_to_latest(q):
+    """Return the newest item (or None), discarding any older ones."""
+    item = None
+    while True:
+        try:
+            item = q.get_nowait()
+        except queue.Empty:
+            return item
+
+def capture_pose(gmodel, pool, cache):
+    """Hand the newest frame to the Gemini worker unless one is still running."""
+    frame = drain_to_latest(frame_queue)
+    if "analysis" in st.session_state:
+        # Still analyzing the previous capture: drop this one.
+        return
+    if frame is not None:
+        parts = []
+        st.session_state["capture"] = preview_jpeg(frame)
+        # Results of the previous pose must not outlive its preview.
+        for key in ("analysis_error", "feedback", "speech", "speech_job"):
+            st.session_state.pop(key, None)
+        st.session_state["analysis"] = (pool.submit(analyze_frame, gmodel, cache, frame, parts), parts)
 
 class VideoTransformer(VideoTransformerBase):
-    def transform(self, frame):
-        img = frame.to_ndarray(format="bgr24")
-        frame_queue.put(img)
+    def __init__(self, frames):
+        self.frames = frames
+        self.dropped = 0  # stale frames evicted before anyone read them
+    def recv(self, frame: av.VideoFrame) -> av.VideoFrame:
+        self.dropped += put_latest(self.frames, frame.to_ndarray(format="rgb24"))
         return frame
 
 # -----------------------------
@@ -54,7 +307,7 @@ st.title("🧘 AsanaSense - Hands Free")
 
 ctx = webrtc_streamer(
     key="asana",
-    video_transformer_factory=VideoTransformer,
+    video_transformer_factory=lambda: VideoTransformer(frame_queue),
     audio_processor_factory=lambda: audio_processor,
     media_stream_constraints={"video": True, "audio": True}
 )
@@ -62,44 +315,51 @@ ctx = webrtc_streamer(
 # -----------------------------
 # LOOP: Check for hotword
 # -----------------------------
-if ctx.state.playing:
-    if not audio_processor.q.empty():
-        pcm = audio_processor.q.get()
-        # save temp wav
-        tmp_wav = tempfile.NamedTemporaryFile(delete=False, suffix=".wav")
-        import soundfile as sf
-        sf.write(tmp_wav.name, pcm, 16000)
-        result = model.transcribe(tmp_wav.name)
-        if "click" in result["text"].lower():
-            st.success("🎤 Heard 'click' – capturing pose...")
-
-            if not frame_queue.empty():
-                frame = frame_queue.get()
-                # Save frame as PNG
-                img_path = tempfile.NamedTemporaryFile(delete=False, suffix=".png").name
-                Image.fromarray(frame).save(img_path)
-                st.image(frame, caption="Captured Pose")
-
-                # GEMINI VISION
-                with open(img_path, "rb") as f:
-                    img_bytes = f.read()
-
-                gmodel = genai.GenerativeModel("gemini-1.5-flash")
-                prompt = "Analyze this yoga pose and provide corrective feedback."
-                try:
-                    resp = gmodel.generate_content([prompt, {"mime_type":"image/png","data":img_bytes}])
-                    feedback = resp.text
-                    st.markdown(f"**Feedback:** {feedback}")
-
-                    # TTS playback
-                    tts = gTTS(feedback)
-                    tts_path = "feedback.mp3"
-                    tts.save(tts_path)
-                    with open(tts_path, "rb") as f:
-                        st.audio(f.read(), format="audio/mp3", autoplay=True)
-                except Exception as e:
-                    st.error(str(e))
-
+# Streamlit only reruns on user events; poll so the hotword and the
+# Gemini worker are picked up while the user is hands-free.
+if ctx.state.playing or "analysis" in st.session_state or "speech_job" in st.session_state:
+    st_autorefresh(interval=100, key="hotword_poll")
 
+# A pending autorefresh rerun stops this script at its next st.* element
+# call, so every state change for a capture happens before rendering
+# starts. Whisper, Gemini and gTTS all run on workers and are only
+# polled here; cached resources are fetched up front for the same reason.
+pool, tts_index = get_executor(), get_tts_index()
+if "analysis" in st.session_state:
+    collect_analysis(pool, tts_index)
+if "speech_job" in st.session_state:
+    collect_speech()
 
+if ctx.state.playing:
+    whisper, hotword_pool = get_whisper(), get_hotword_executor()
+    gmodel, cache = get_gmodel(), gemini_cache()
+    pending = st.session_state.get("hotword")
+    if pending is None:
+        window = audio_processor.window()
+        if window is not None:
+            start, audio = window
+            st.session_state["hotword"] = (start, hotword_pool.submit(find_hotword, whisper, audio))
+    elif pending[1].done():
+        del st.session_state["hotword"]
+        start, future = pending
+        try:
+            hit_end = future.result()
+        except Exception as e:
+            st.session_state["analysis_error"] = f"Transcription failed: {e}"
+        else:
+            if hit_end is not None:
+                audio_processor.commit(start, hit_end)
+                capture_pose(gmodel, pool, cache)
 
+if ctx.video_processor is not None:
+    st.caption(f"Stale camera frames skipped: {ctx.video_processor.dropped}")
+if "capture" in st.session_state:
+    st.image(st.session_state["capture"], caption="Captured Pose")
+if "analysis" in st.session_state:
+    st.success("🎤 Heard 'click' – capturing pose...")
+    st.markdown(f"**Feedback:** {''.join(st.session_state['analysis'][1])}")
+elif "feedback" in st.session_state:
+    render_feedback()
+# Kept until the next capture; a single-run st.error would vanish on the next poll.
+if "analysis_error" in st.session_state:
+    st.error(st.session_state["analysis_error"])
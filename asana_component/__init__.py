@@ -14,5 +14,10 @@ _asana_component = components.declare_component(
 
 
 def render(props: Dict[str, Any], key: Optional[str] = None) -> Optional[Dict[str, Any]]:
-    """Render the AsanaSense custom component."""
+    """Render the AsanaSense custom component.
+
+    Returns the latest event sent by the frontend. Informational events
+    (``voice_transcript``, ``voice_unsupported``) may arrive coalesced as
+    ``{"type": "batch", "events": [...]}``.
+    """
     return _asana_component(props=props, key=key, default=None)
@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from pathlib import Path
+from typing import Optional
+
+import streamlit as st
+from gtts import gTTS
+
+_CACHE_DIR = Path(tempfile.gettempdir()) / "asanasense_tts"
+_MAX_ENTRIES = 128
+
+
+class _TTSIndex:
+    """LRU index over the synthesized clips stored in the cache directory."""
+
+    def __init__(self, cache_dir: Path, max_entries: int) -> None:
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.keys: "OrderedDict[str, None]" = OrderedDict()
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        # Adopt clips left behind by a previous process, oldest first.
+        for path in sorted(cache_dir.glob("*.mp3"), key=lambda p: p.stat().st_mtime):
+            self.keys[path.stem] = None
+        self._evict()
+
+    def path_for(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.mp3"
+
+    def touch(self, key: str) -> None:
+        self.keys[key] = None
+        self.keys.move_to_end(key)
+        self._evict()
+
+    def discard(self, key: str) -> None:
+        self.keys.pop(key, None)
+
+    def _evict(self) -> None:
+        while len(self.keys) > self.max_entries:
+            stale, _ = self.keys.popitem(last=False)
+            try:
+                os.remove(self.path_for(stale))
+            except FileNotFoundError:
+                pass
+
+
+@st.cache_resource
+def get_index() -> _TTSIndex:
+    return _TTSIndex(_CACHE_DIR, _MAX_ENTRIES)
+
+
+def _synthesize(text: str, lang: str) -> bytes:
+    buffer = BytesIO()
+    gTTS(text, lang=lang).write_to_fp(buffer)
+    return buffer.getvalue()
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def tts_cached(text: str, lang: str = "en", index: Optional[_TTSIndex] = None) -> bytes:
+    """Return MP3 bytes for ``text``, synthesizing with gTTS only on a cache miss.
+
+    Worker threads should pass ``index`` (from :func:`get_index` on the script
+    thread) so they never touch Streamlit's cache themselves.
+    """
+    key = hashlib.sha256(f"{lang}|{text}".encode()).hexdigest()
+    if index is None:
+        index = get_index()
+    path = index.path_for(key)
+
+    with index.lock:
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            index.discard(key)
+        else:
+            index.touch(key)
+            return data
+
+    data = _synthesize(text, lang)
+    with index.lock:
+        _write_atomic(path, data)
+        index.touch(key)
+    return data